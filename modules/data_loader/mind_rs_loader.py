@@ -1,8 +1,12 @@
+import math
 import torch
+import numpy as np
 import modules.dataset as module_dataset
 
 from collections import defaultdict
+from functools import partial
 from torch.nn.utils.rnn import pad_sequence
+from torch.utils.data import Sampler
 from torch.utils.data.dataloader import DataLoader
 from modules.dataset import NewsDataset, ImpressionDataset
 from modules.utils import Tokenizer
@@ -21,12 +25,71 @@ def pad_feat(input_feat):
     return input_pad
 
 
-def collate_fn(data):
+def trim_history(input_pad):
+    """cut the padded history dimension down to the longest history in the batch"""
+    max_length = max(int(input_pad["history_length"].max()), 1)
+    for k, v in input_pad.items():
+        if k.startswith("history") and k != "history_length" and v.dim() > 1:
+            input_pad[k] = v[:, :max_length]
+    return input_pad
+
+
+def pack_history(input_pad):
+    """
+    locate the real (non-padded) history news in the flattened [N * H] history layout,
+    so that models can encode sum(history_length) news instead of N * H
+    """
+    history_size = input_pad["history_index"].size(1)
+    lengths = input_pad["history_length"].long().clamp(max=history_size)
+    mask = torch.arange(history_size).unsqueeze(0) < lengths.unsqueeze(1)
+    input_pad["history_flat_index"] = torch.nonzero(mask.view(-1)).squeeze(1)
+    return input_pad
+
+
+def collate_fn(data, trim=False, pack=False):
     input_feat = defaultdict(lambda: [])
     for feat in data:
         for k, v in feat.items():
             input_feat[k].append(v)
-    return pad_feat(input_feat)
+    input_pad = pad_feat(input_feat)
+    if trim and "history_length" in input_pad:
+        input_pad = trim_history(input_pad)
+    if pack and "history_length" in input_pad and "history_index" in input_pad:
+        input_pad = pack_history(input_pad)
+    return input_pad
+
+
+class BucketSampler(Sampler):
+    """
+    Batch sampler that groups samples with similar history lengths, so that padded history tensors stay short.
+    Samples are sorted by length, split into buckets of batch_size * bucket_size, shuffled inside each bucket,
+    and the resulting batches are yielded in random order (when shuffle is True).
+    """
+
+    def __init__(self, lengths, batch_size, bucket_size=10, shuffle=True):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+
+    def __iter__(self):
+        indices = np.arange(len(self.lengths))
+        if self.shuffle:  # random tie-breaking between samples with the same length
+            indices = np.random.permutation(indices)
+        indices = indices[np.argsort(self.lengths[indices], kind="stable")]
+        bucket_len = self.batch_size * self.bucket_size
+        batches = []
+        for start in range(0, len(indices), bucket_len):
+            bucket = indices[start:start + bucket_len]
+            if self.shuffle:
+                bucket = np.random.permutation(bucket)
+            batches.extend(bucket[i:i + self.batch_size].tolist() for i in range(0, len(bucket), self.batch_size))
+        if self.shuffle:
+            batches = [batches[i] for i in np.random.permutation(len(batches))]
+        return iter(batches)
+
+    def __len__(self):
+        return math.ceil(len(self.lengths) / self.batch_size)
 
 
 class NRDataLoader:
@@ -36,10 +99,16 @@ class NRDataLoader:
         self.tokenizer = Tokenizer(**kwargs)
         bs = kwargs.get("batch_size", 64)
         impression_bs = kwargs.get("impression_batch_size", 1)
-        self.fn = collate_fn
+        self.bucket_batching = kwargs.get("bucket_batching", False)
+        self.fn = partial(collate_fn, trim=self.bucket_batching, pack=kwargs.get("pack_history", False))
         module_dataset_name = kwargs.get("dataset_class", "NewsRecDataset")
         self.train_set = getattr(module_dataset, module_dataset_name)(self.tokenizer, phase="train", **kwargs)
-        self.train_loader = DataLoader(self.train_set, bs, pin_memory=True, collate_fn=self.fn)
+        if self.bucket_batching:
+            batch_sampler = BucketSampler(self.train_set.history_lengths, bs, kwargs.get("bucket_size", 10))
+            self.train_loader = DataLoader(self.train_set, batch_sampler=batch_sampler, pin_memory=True,
+                                           collate_fn=self.fn)
+        else:
+            self.train_loader = DataLoader(self.train_set, bs, pin_memory=True, collate_fn=self.fn)
         # setup news and user dataset
         self.valid_set = getattr(module_dataset, module_dataset_name)(self.tokenizer, phase="valid", **kwargs)
         self.test_set = getattr(module_dataset, module_dataset_name)(self.tokenizer, phase="test", **kwargs)
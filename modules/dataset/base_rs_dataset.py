@@ -100,6 +100,11 @@ class NewsRecDataset(Dataset):
     def __len__(self):
         return len(self.positive_news)
 
+    @property
+    def history_lengths(self):
+        """history length of the user behind each training sample, used for bucketing batches"""
+        return [self.behaviors["history_length"][imp_index] for _, imp_index in self.positive_news]
+
 
 class NewsDataset(Dataset):
     def __init__(self, dataset: NewsRecDataset):
@@ -128,7 +133,7 @@ class ImpressionDataset(Dataset):
             self.behaviors = {
                 k: [v[i] for i in indices] for k, v in self.behaviors.items()
             }
-        self.news_embeds = news_embeds  # news embeddings (numpy matrix)
+        self.news_embeds = news_embeds  # news embeddings (numpy matrix, float32 or float16)
 
     def __getitem__(self, index):
         candidate = self.behaviors["candidate_news"][index]
@@ -149,12 +154,12 @@ class ImpressionDataset(Dataset):
             input_feat.update(
                 {"label": torch.tensor(self.behaviors["labels"][index])}
             )  # load true label of behaviors
-        if self.news_embeds is not None:
+        if self.news_embeds is not None:  # the cache may be stored in half precision
             input_feat["candidate_news"] = torch.tensor(
-                self.news_embeds[candidate]
+                self.news_embeds[candidate], dtype=torch.float
             )  # load news embed from cache
             input_feat["history_news"] = torch.tensor(
-                self.news_embeds[history]
+                self.news_embeds[history], dtype=torch.float
             )  # load news embed from cache
         input_feat.update(
             self.dataset.load_news_index(candidate, "candidate")
@@ -166,3 +171,8 @@ class ImpressionDataset(Dataset):
 
     def __len__(self):
         return len(self.behaviors["impression_index"])
+
+    @property
+    def history_lengths(self):
+        """history length of each impression, used for bucketing batches"""
+        return self.behaviors["history_length"]
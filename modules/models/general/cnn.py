@@ -1,3 +1,5 @@
+from typing import Tuple
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -41,3 +43,23 @@ class Conv1D(nn.Module):
                                      self.conv3(feature),
                                      self.conv4(torch.cat([feature, padding_zeros], dim=1)),
                                      self.conv5(feature)], dim=1))
+
+
+class CNNAttention(nn.Module):
+    """
+    Conv1d -> ReLU -> additive attention pipeline written in TorchScript-compatible form.
+    It shares the weights of the given modules, and is used to build frozen copies of news encoders for inference.
+    """
+    def __init__(self, conv: nn.Conv1d, attention: nn.Module):
+        super(CNNAttention, self).__init__()
+        self.conv = conv
+        self.attention = attention
+
+    # Input
+    # embed : [batch_size, length, feature_dim]
+    # Output
+    # vector: [batch_size, kernel_num], weight: [batch_size, length, 1]
+    def forward(self, embed: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        features = F.relu(self.conv(embed.transpose(1, 2))).transpose(1, 2)
+        weight = self.attention(features)
+        return torch.sum(features * weight, dim=-2), weight
@@ -12,8 +12,13 @@ class NewsEmbedding(nn.Module):
         self.embed_dim = kwargs.get("embed_dim", 300)
         if self.embedding_type == "glove":
             self.embeds = load_embeddings(**kwargs)
-            self.embedding = nn.Embedding.from_pretrained(torch.FloatTensor(self.embeds), freeze=False)
+            freeze = kwargs.get("freeze_embedding", False)
+            self.embedding = nn.Embedding.from_pretrained(torch.FloatTensor(self.embeds), freeze=freeze)
             self.embed_dim = self.embeds.shape[1]
+            embedding_dtype = kwargs.get("embedding_dtype", "float32")  # options: float32, float16, bfloat16
+            if freeze and embedding_dtype != "float32":
+                # a frozen table needs no fp32 master weights, half precision halves the bytes of every lookup
+                self.embedding.to(getattr(torch, embedding_dtype))
         elif self.embedding_type == "init":
             self.word_dict = kwargs.get("word_dict", None)
             assert self.word_dict is not None, "Please provide word dictionary for embedding initialization"
@@ -47,6 +52,8 @@ class NewsEmbedding(nn.Module):
     def forward(self, news, news_mask, **kwargs):
         if self.embedding_type in ["glove", "init"]:
             embedding = self.embedding(news)
+            if embedding.dtype != torch.float:  # only the gathered rows are upcast
+                embedding = embedding.float()
         else:  # for bert like language model
             embedding = kwargs.get("embedding", None)
             output = self.embedding(news, news_mask, inputs_embeds=embedding)
@@ -24,6 +24,18 @@ def attention(query, key, value, mask=None, dropout=None):
     return torch.matmul(p_attn, value), p_attn
 
 
+def gather_last_step(outputs, lengths):
+    """
+    Select the output at the last valid step of right-padded sequences, without a device-to-host sync.
+    For a unidirectional RNN this equals the final hidden state of the packed sequence.
+    :param outputs: [batch_size, seq_len, hidden_dim], outputs of a batch_first RNN
+    :param lengths: [batch_size], valid length of each sequence
+    :return: [batch_size, hidden_dim]
+    """
+    last_index = (lengths.long() - 1).clamp(min=0).view(-1, 1, 1).expand(-1, 1, outputs.size(-1))
+    return outputs.gather(1, last_index).squeeze(dim=1)
+
+
 class AttLayer(nn.Module):
 
     def __init__(self, word_emb_dim, attention_hidden_dim):
@@ -1,9 +1,8 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torch.nn.utils.rnn import pack_padded_sequence
 
-from modules.models.general import TopicLayer, AttLayer
+from modules.models.general import TopicLayer, AttLayer, gather_last_step
 from modules.models.nrs.rs_base import MindNRSBase
 
 
@@ -62,9 +61,8 @@ class BATMRSModel(MindNRSBase):
         if self.user_history_connect == "concat":
             return {"user_embed": history_news, "user_weight": None}
         if self.user_encoder_name == "gru":
-            history_length = input_feat["history_length"].cpu()
-            packed_y = pack_padded_sequence(history_news, history_length, batch_first=True, enforce_sorted=False)
-            user_vector = self.user_encode_layer(packed_y)[1].squeeze(dim=0)
+            y = self.user_encode_layer(history_news)[0]
+            user_vector = gather_last_step(y, input_feat["history_length"])  # no host sync on history lengths
             user_weight = None
             # y = self.user_encode_layer(history_news)[0]
             # user_vector, user_weight = self.user_att_layer(y)  # additive attention layer
@@ -1,11 +1,10 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torch.nn.utils.rnn import pack_padded_sequence
 
-from modules.models.general import AttLayer, Conv1D
+from modules.models.general import AttLayer, Conv1D, CNNAttention, gather_last_step
 from modules.models.nrs.rs_base import MindNRSBase
-from modules.utils import read_json, get_default_upath
+from modules.utils import load_uid2index, get_default_upath
 
 
 class LSTURRSModel(MindNRSBase):
@@ -37,7 +36,7 @@ class LSTURRSModel(MindNRSBase):
         if self.use_category:
             news_dim = self.num_filters + self.category_dim * 2
         if self.user_embed_method == "init" or self.user_embed_method == "concat":
-            uid2index = read_json(get_default_upath(**kwargs))
+            uid2index = load_uid2index(get_default_upath(**kwargs))
             self.user_embedding = nn.Embedding(
                 len(uid2index) + 1, user_dim
             )  # count from 1
@@ -49,15 +48,52 @@ class LSTURRSModel(MindNRSBase):
             self.user_affine = None
             self.transform_layer = nn.Linear(news_dim + user_dim, news_dim)
         self.user_att_layer = None  # no attentive layer for LSTUR model
+        self.scripted_text_encoder = None  # frozen TorchScript copy of CNN+attention, only used in evaluation
+        self.compile_news_encoder = kwargs.get("compile_news_encoder", False)
+        self.compiled_encoders = {}  # kept in a dict so that compiled wrappers stay out of the state dict
+
+    def script_text_encoder(self, enable=True):
+        """build (or release) a frozen TorchScript copy of the CNN+attention text encoder for fast evaluation"""
+        if enable and self.news_encode_layer.cnn_method == "naive":
+            encoder = CNNAttention(self.news_encode_layer.conv, self.news_att_layer.attention).eval()
+            self.scripted_text_encoder = torch.jit.optimize_for_inference(torch.jit.script(encoder))
+        else:
+            self.scripted_text_encoder = None
+
+    def compiled_text_encoder(self):
+        """torch.compile version of the CNN+attention text encoder, it reads the live weights of the model"""
+        if "text" not in self.compiled_encoders:
+            encoder = CNNAttention(self.news_encode_layer.conv, self.news_att_layer.attention)
+            # default mode: "reduce-overhead" returns CUDA-graph-owned outputs that the next call may overwrite
+            # (candidate and history news are encoded in one forward) and would nest inside use_cuda_graph captures
+            self.compiled_encoders["text"] = torch.compile(encoder, dynamic=False)
+        return self.compiled_encoders["text"]
+
+    def text_encode(self, embed):
+        """embed: Size is [N * H, S, E], return news vectors and attention weights"""
+        if not self.training:  # training always runs eagerly
+            if self.scripted_text_encoder is not None:
+                return self.scripted_text_encoder(embed)
+            if self.compile_news_encoder and self.news_encode_layer.cnn_method == "naive":
+                return self.compiled_text_encoder()(embed)
+        if self.news_encode_layer.cnn_method == "naive":
+            conv = self.news_encode_layer.conv
+            # [N, S, E] viewed as channels_last [N, E, 1, S]: conv2d runs on it without a transposing copy,
+            # and its channels_last output is already a contiguous [N, S, F] tensor for the attention layer
+            features = F.relu(
+                F.conv2d(embed.transpose(1, 2).unsqueeze(2), conv.weight.unsqueeze(2), conv.bias,
+                         padding=(0, conv.padding[0]))
+            ).squeeze(2).transpose(1, 2)
+        else:
+            features = self.news_encode_layer(embed.transpose(1, 2)).transpose(1, 2)
+        return self.news_att_layer(self.dropouts(features))
 
     def news_encoder(self, input_feat):
         """input_feat: Size is [N * H, S]"""
         # 1. worod embedding
         embed = self.dropouts(self.embedding_layer(**input_feat))
-        # 2. CNN
-        features = self.news_encode_layer(embed.transpose(1, 2)).transpose(1, 2)
-        # 3. attention
-        vector, weight = self.news_att_layer(self.dropouts(features))
+        # 2. CNN and 3. attention
+        vector, weight = self.text_encode(embed)
         if self.use_category:
             category_vector = self.category_embedding(input_feat["category"])
             subvert_vector = self.subvert_embedding(input_feat["subvert"])
@@ -67,27 +103,38 @@ class LSTURRSModel(MindNRSBase):
             )
         return {"news_embed": vector, "news_weight": weight}
 
+    def run_news_encoder(self, input_feat, run_name, **kwargs):
+        if run_name != "history" or "history_flat_index" not in input_feat or self.return_weight:
+            return super().run_news_encoder(input_feat, run_name, **kwargs)
+        # packed history: only encode the news that really appear in user histories
+        flat_index = input_feat["history_flat_index"]
+        feat = self.organize_feat(input_feat, run_name=run_name)
+        padded_num = feat["news"].size(0)  # N * H
+        for name, value in feat.items():
+            if torch.is_tensor(value) and value.dim() > 0 and value.size(0) == padded_num:
+                feat[name] = value.index_select(0, flat_index)
+        news_embed = self.news_encoder(feat)["news_embed"]
+        # scatter back to the padded layout expected by the GRU; padded slots stay zero
+        padded = news_embed.new_zeros(padded_num, news_embed.size(-1)).index_copy(0, flat_index, news_embed)
+        input_feat["history_news"] = padded.view(input_feat["history_length"].size(0), -1, news_embed.size(-1))
+        return input_feat
+
     def user_encoder(self, input_feat):
         history_news, user_ids = input_feat["history_news"], input_feat["uid"]
-        history_length = input_feat["history_length"].cpu()
-        packed_y = pack_padded_sequence(
-            history_news, history_length, batch_first=True, enforce_sorted=False
-        )
+        history_length = input_feat["history_length"]
         if self.user_embed_method == "init":
             user_embed = F.relu(
                 self.user_affine(self.user_embedding(user_ids)), inplace=True
             )
-            _, user_vector = self.user_encode_layer(
-                packed_y, user_embed.unsqueeze(dim=0)
-            )
-            user_vector = user_vector.squeeze(dim=0)
+            y = self.user_encode_layer(history_news, user_embed.unsqueeze(dim=0))[0]
+            user_vector = gather_last_step(y, history_length)
         elif self.user_embed_method == "concat":
             user_embed = self.user_embedding(user_ids)
-            last_hidden = self.user_encode_layer(packed_y)[1].squeeze(dim=0)
+            last_hidden = gather_last_step(self.user_encode_layer(history_news)[0], history_length)
             user_vector = F.relu(
                 self.transform_layer(torch.cat((last_hidden, user_embed), dim=1)),
                 inplace=True,
             )
         else:  # default use last hidden output from GRU network
-            user_vector = self.user_encode_layer(packed_y)[1].squeeze(dim=0)
+            user_vector = gather_last_step(self.user_encode_layer(history_news)[0], history_length)
         return {"user_embed": user_vector}
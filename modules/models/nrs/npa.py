@@ -4,7 +4,7 @@ import torch.nn as nn
 
 from modules.models import PersonalizedAttentivePooling
 from modules.models.nrs.rs_base import MindNRSBase
-from modules.utils import read_json, get_default_upath
+from modules.utils import load_uid2index, get_default_upath
 
 
 class NPARSModel(MindNRSBase):
@@ -24,7 +24,7 @@ class NPARSModel(MindNRSBase):
             nn.Conv1d(self.embedding_dim, self.num_filters, self.window_size, padding=padding),
             nn.ReLU(inplace=True)
         )
-        uid2index = read_json(get_default_upath(**kwargs))
+        uid2index = load_uid2index(get_default_upath(**kwargs))
         self.user_embedding = nn.Embedding(len(uid2index) + 1, self.user_emb_dim)
         self.transform_news = nn.Linear(self.user_emb_dim, self.attention_hidden_dim)
         self.transform_user = nn.Linear(self.user_emb_dim, self.attention_hidden_dim)
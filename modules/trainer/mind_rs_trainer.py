@@ -1,4 +1,3 @@
-import copy
 import math
 import os
 from collections import defaultdict
@@ -8,10 +7,12 @@ import torch
 import torch.distributed
 import pandas as pd
 import numpy as np
+from torch.nn.utils import parameters_to_vector
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 from modules.config.configuration import Configuration
+from modules.data_loader import BucketSampler
 from modules.dataset import ImpressionDataset
 from modules.trainer import NCTrainer
 from modules.utils import (
@@ -20,6 +21,7 @@ from modules.utils import (
     get_news_embeds,
     gpu_stat,
     group_auc,
+    batch_metrics,
 )
 
 
@@ -31,8 +33,10 @@ class MindRSTrainer(NCTrainer):
     def __init__(self, model, config: Configuration, data_loader, **kwargs):
         super().__init__(model, config, data_loader, **kwargs)
         self.valid_interval = config.get("valid_interval", 0.6)
+        self.valid_every = max(1, math.ceil(self.len_epoch * self.valid_interval))
         self.add_l2norm = config.get("add_l2norm", False)
         self.l2_lambda = config.get("l2_lambda", 1e-7)
+        self.l2_params = [p for p in self.model.parameters() if p.requires_grad]
         self.fast_evaluation = config.get("fast_evaluation", True)
         self.log_kl_div = config.get("log_kl_div", False)
         self.topic_variant = config.get("topic_variant", "base")
@@ -47,8 +51,7 @@ class MindRSTrainer(NCTrainer):
         val_log = self._valid_epoch(middle_name=f"valid_{epoch}_{batch_idx}")
         log.update({"val_" + k: v for k, v in val_log.items()})
         wandb.define_metric("val/*", step_metric="val/step")
-        wandb.log({"val/step": self.step})
-        wandb.log({"val/" + k: v for k, v in val_log.items() if v and v != 0})
+        wandb.log({"val/step": self.step, **{"val/" + k: v for k, v in val_log.items() if v and v != 0}})
         for k, v in val_log.items():
             self.writer.add_scalar(k, v)
         if do_monitor:
@@ -74,20 +77,20 @@ class MindRSTrainer(NCTrainer):
             # set step for tensorboard
             self.step = (epoch - 1) * self.len_epoch + batch_idx
             self.writer.set_step(self.step)
-            label = copy.deepcopy(batch_dict["label"].cpu().numpy())
+            # asynchronous copy of labels, it is finished by the time predictions are fetched after backward
+            label = batch_dict["label"].detach().to("cpu", non_blocking=True)
             # load data to device
             batch_dict = load_batch_data(batch_dict, self.device)
             # setup model and train model
             self.optimizer.zero_grad()
-            output = self.model(batch_dict)
-            loss = self.criterion(output["pred"], batch_dict["label"])
-            self.train_metrics.update(
-                "auc", group_auc(label, output["pred"].cpu().detach().numpy())
-            )
+            with self.accelerator.autocast():  # mixed precision follows the accelerate config (fp16/bf16)
+                output = self.model(batch_dict)
+                loss = self.criterion(output["pred"], batch_dict["label"])
             # gpu_used = torch.cuda.memory_allocated() / 1024 ** 3
             bar_description = f"Epoch: {epoch} {gpu_stat()}"
             if self.add_l2norm:
-                l2_norm = sum(p.pow(2.0).sum() for p in self.model.parameters())
+                params = parameters_to_vector(self.l2_params)  # one flat buffer
+                l2_norm = torch.dot(params, params)
                 loss += self.l2_lambda * l2_norm
                 self.train_metrics.update("l2_norm", l2_norm.item())
             if self.with_entropy or self.show_entropy:
@@ -111,6 +114,8 @@ class MindRSTrainer(NCTrainer):
             bar_description += f" Loss: {round(loss.item(), 4)}"
             self.accelerator.backward(loss)
             self.optimizer.step()
+            pred = output["pred"].float().detach().cpu().numpy()  # synchronizes the label copy as well
+            self.train_metrics.update("auc", group_auc(label.numpy(), pred))
             # record loss
             self.train_metrics.update("loss", loss.item())
             if batch_idx % self.log_step == 0:
@@ -126,12 +131,11 @@ class MindRSTrainer(NCTrainer):
                 bar.set_description(bar_description)
                 train_log = self.train_metrics.result()
                 wandb.define_metric("train/*", step_metric="train/step")
-                wandb.log({"train/step": self.step})
-                wandb.log(
-                    {f"train/{k}": v for k, v in train_log.items() if v and v != 0}
+                wandb.log(  # one logged (and flushed) step per block
+                    {"train/step": self.step, **{f"train/{k}": v for k, v in train_log.items() if v and v != 0}}
                 )
                 self.train_metrics.reset()
-            if (batch_idx + 1) % math.ceil(self.len_epoch * self.valid_interval) == 0:
+            if (batch_idx + 1) % self.valid_every == 0:
                 self._validation(epoch, batch_idx)
         if self.lr_scheduler is not None:
             self.lr_scheduler.step()
@@ -160,7 +164,7 @@ class MindRSTrainer(NCTrainer):
         return_weight = self.config.get("return_weight", False)
 
         saved_weight_num = self.config.get("saved_weight_num", 250)
-        with torch.no_grad():
+        with torch.no_grad(), self.accelerator.autocast():
             try:  # try to do fast evaluation: cache news embeddings
                 if (
                     valid_method == "fast_evaluation"
@@ -169,13 +173,25 @@ class MindRSTrainer(NCTrainer):
                     and not topic_variant == "variational_topic"
                 ):
                     news_loader = self.mind_loader.news_loader
-                    news_embeds = get_news_embeds(
-                        model,
-                        news_loader,
-                        device=self.device,
-                        accelerator=self.accelerator,
-                        num_processes=self.config.get("num_processes", None),
-                    )
+                    script_encoder = self.config.get(
+                        "script_news_encoder", False
+                    ) and hasattr(model, "script_text_encoder")
+                    if script_encoder:  # use a frozen TorchScript news encoder
+                        model.script_text_encoder()
+                    try:
+                        news_embeds = get_news_embeds(
+                            model,
+                            news_loader,
+                            device=self.device,
+                            accelerator=self.accelerator,
+                            num_processes=self.config.get("num_processes", None),
+                            use_cuda_graph=self.config.get("use_cuda_graph", False),
+                        )
+                    finally:
+                        if script_encoder:
+                            model.script_text_encoder(False)
+                    if self.config.get("half_news_embeds", False):
+                        news_embeds = news_embeds.astype(np.float16)  # halve the cache
                 else:
                     news_embeds = None
             except KeyError or RuntimeError:  # slow evaluation: re-calculate news embeddings every time
@@ -185,9 +201,26 @@ class MindRSTrainer(NCTrainer):
                 news_embeds,
                 selected_imp=self.config.get("selected_imp", None),
             )
-            valid_loader = DataLoader(
-                imp_set, impression_bs, collate_fn=self.mind_loader.fn
-            )
+            eval_workers = self.config.get("eval_workers", 4)
+            loader_kwargs = {
+                "collate_fn": self.mind_loader.fn,
+                "num_workers": eval_workers,
+                "pin_memory": True,
+            }
+            if eval_workers > 0:  # collate the next batches while the model runs
+                loader_kwargs["prefetch_factor"] = self.config.get("eval_prefetch", 4)
+            if self.config.get("bucket_batching", False):
+                batch_sampler = BucketSampler(
+                    imp_set.history_lengths,
+                    impression_bs,
+                    self.config.get("bucket_size", 10),
+                    shuffle=False,
+                )
+                valid_loader = DataLoader(
+                    imp_set, batch_sampler=batch_sampler, **loader_kwargs
+                )
+            else:
+                valid_loader = DataLoader(imp_set, impression_bs, **loader_kwargs)
             valid_loader = self.accelerator.prepare_data_loader(valid_loader)
             bar = tqdm(
                 enumerate(valid_loader),
@@ -195,50 +228,53 @@ class MindRSTrainer(NCTrainer):
                 disable=self.config.get("disable_tqdm", True),
             )
             for vi, batch_dict in bar:
-                batch_dict = load_batch_data(batch_dict, self.device)
+                batch_dict = load_batch_data(
+                    batch_dict, self.device, non_blocking=True
+                )
                 label = batch_dict["label"].cpu().numpy()
                 out_dict = model(batch_dict)  # run model
-                pred = out_dict["pred"].cpu().numpy()
+                pred = out_dict["pred"].float().cpu().numpy()
                 can_len = batch_dict["candidate_length"].cpu().numpy()
                 his_len = batch_dict["history_length"].cpu().numpy()
+                bar.set_description(f"Validating: {gpu_stat()}")
+                scores = {
+                    name: score * 100
+                    for name, score in batch_metrics(
+                        self.metric_funcs, label, pred, can_len
+                    ).items()
+                }  # evaluate the whole batch at once and convert to percentage
+                # move indices and weights to host once per batch instead of once per impression
+                imp_index = batch_dict["impression_index"].cpu().tolist()
+                if return_weight:
+                    cand_index = batch_dict["candidate_index"].cpu().numpy()
+                    hist_index = batch_dict["history_index"].cpu().numpy()
+                    weights = {
+                        name: weight.float().cpu().numpy()
+                        for name, weight in out_dict.items()
+                        if "weight" in name
+                    }
                 for i in range(len(label)):
-                    bar.set_description(f"Validating: {gpu_stat()}")
-                    index = (
-                        batch_dict["impression_index"][i].cpu().tolist()
-                    )  # record impression index
+                    index = imp_index[i]  # record impression index
                     result_dict[index] = {
-                        m.__name__: m(label[i][: can_len[i]], pred[i][: can_len[i]])
-                        * 100
-                        for m in self.metric_funcs
-                    }  # convert to percentage
+                        name: score[i] for name, score in scores.items()
+                    }
                     if return_weight:
                         saved_items = {
                             "impression_index": index,
                             "results": result_dict[index],
                             "label": label[i][: can_len[i]],
-                            "candidate_index": batch_dict["candidate_index"][i][
-                                : can_len[i]
-                            ]
-                            .cpu()
-                            .tolist(),
-                            "history_index": batch_dict["history_index"][i][
-                                : his_len[i]
-                            ]
-                            .cpu()
-                            .numpy(),
+                            "candidate_index": cand_index[i][: can_len[i]].tolist(),
+                            "history_index": hist_index[i][: his_len[i]],
                             "pred_score": pred[i][: can_len[i]],
                         }
                         for name, indices in saved_items.items():
                             weight_dict[name].append(indices)
-                        for name, weight in out_dict.items():
-                            if "weight" in name:
-                                if "candidate" in name:
-                                    length = can_len[i]
-                                else:
-                                    length = his_len[i]
-                                weight_dict[name].append(
-                                    weight[i][:length].cpu().numpy()
-                                )
+                        for name, weight in weights.items():
+                            if "candidate" in name:
+                                length = can_len[i]
+                            else:
+                                length = his_len[i]
+                            weight_dict[name].append(weight[i][:length])
                 if vi >= saved_weight_num and return_weight:
                     break
             result_dict = gather_dict(
@@ -263,7 +299,6 @@ class MindRSTrainer(NCTrainer):
             torch.save(dict(weight_dict), weight_path)
             self.logger.info(f"Saved weight to {weight_path}")
         del batch_dict
-        torch.cuda.empty_cache()
         return eval_result
 
     def evaluate(self, dataset, model, epoch=0, prefix="val"):
@@ -1,5 +1,6 @@
 from modules.utils.general_utils import *
 from modules.utils.metric_utils import *
+from modules.utils.metrics_fused import *
 from modules.utils.preprocess_utils import *
 from modules.utils.loss_utils import *
 from modules.utils.dataset_utils import *
@@ -158,13 +158,14 @@ def convert_dict_to_numpy(dict_object):
     return np.array([dict_object[i] for i in range(len(dict_object))])
 
 
-def load_batch_data(batch_dict, device, multi_gpu=True):
+def load_batch_data(batch_dict, device, multi_gpu=True, non_blocking=False):
     """
     load batch data to default device
+    :param non_blocking: asynchronous copy, only effective for pinned memory
     """
     if torch.distributed.is_initialized() and multi_gpu:  # use multi-gpu
         return batch_dict
-    return {k: v.to(device) for k, v in batch_dict.items()}
+    return {k: v.to(device, non_blocking=non_blocking) for k, v in batch_dict.items()}
 
 
 def gpu_stat():
@@ -3,6 +3,7 @@ import numpy as np
 from sklearn.metrics import f1_score
 from scipy.special import kl_div
 from .auc_utils import roc_auc_score
+from .metrics_fused import eval_all_metrics, FUSED_METRICS
 
 
 class MetricTracker:
@@ -51,7 +52,7 @@ def mrr_score(y_true, y_score):
     Returns:
         np.ndarray: mrr scores.
     """
-    order = np.argsort(y_score)[::-1]
+    order = np.argsort(y_score, kind="stable")[::-1]  # deterministic order of tied scores
     y_true = np.take(y_true, order)
     rr_score = y_true / (np.arange(len(y_true)) + 1)
     return np.sum(rr_score) / np.sum(y_true)
@@ -69,7 +70,7 @@ def dcg_score(y_true, y_score, k=10):
         np.ndarray: dcg scores.
     """
     k = min(np.shape(y_true)[-1], k)
-    order = np.argsort(y_score)[::-1]
+    order = np.argsort(y_score, kind="stable")[::-1]  # deterministic order of tied scores
     y_true = np.take(y_true, order[:k])
     gains = 2 ** y_true - 1
     discounts = np.log2(np.arange(len(y_true)) + 2)
@@ -140,6 +141,26 @@ def ndcg_10(label, pred):
     return ndcg(label, pred, 10)
 
 
+def batch_metrics(metric_funcs, label, pred, lengths):
+    """
+    Evaluate metric functions for every impression of a padded batch
+    :param metric_funcs: list of metric functions, those in FUSED_METRICS are computed together by eval_all_metrics
+    :param label: np.ndarray [N, C]
+    :param pred: np.ndarray [N, C]
+    :param lengths: np.ndarray [N]
+    :return: dictionary of metric name and np.ndarray [N] scores
+    """
+    scores = {}
+    if any(m.__name__ in FUSED_METRICS for m in metric_funcs):
+        fused = dict(zip(FUSED_METRICS, eval_all_metrics(label, pred, lengths)))  # one argsort for all of them
+    for m in metric_funcs:
+        if m.__name__ in FUSED_METRICS:
+            scores[m.__name__] = fused[m.__name__]
+        else:
+            scores[m.__name__] = np.array([m(l[:n], p[:n]) for l, p, n in zip(label, pred, lengths)])
+    return scores
+
+
 def kl_divergence_rowwise(matrix):
     n_rows = matrix.shape[0]
     kl_divergences = []
@@ -0,0 +1,65 @@
+import numpy as np
+
+FUSED_METRICS = ("group_auc", "mean_mrr", "ndcg_5", "ndcg_10")
+
+
+def length_mask(lengths, size):
+    """boolean mask of valid positions for a padded [N, size] batch"""
+    return np.arange(size)[None, :] < np.asarray(lengths)[:, None]
+
+
+def tie_average_ranks(sorted_score):
+    """1-based ranks of an ascending sorted [N, C] array, tied scores share the average rank"""
+    size = sorted_score.shape[1]
+    index = np.broadcast_to(np.arange(size), sorted_score.shape)
+    boundary = np.ones(sorted_score.shape, dtype=bool)
+    boundary[:, 1:] = sorted_score[:, 1:] != sorted_score[:, :-1]
+    first = np.maximum.accumulate(np.where(boundary, index, 0), axis=1)  # first position of each tie group
+    boundary = np.ones(sorted_score.shape, dtype=bool)
+    boundary[:, :-1] = sorted_score[:, :-1] != sorted_score[:, 1:]
+    last = np.minimum.accumulate(np.where(boundary, index, size)[:, ::-1], axis=1)[:, ::-1]
+    return (first + last) / 2 + 1
+
+
+def eval_all_metrics(label, pred, lengths):
+    """
+    Compute group_auc, mean_mrr, ndcg_5 and ndcg_10 of every impression in a padded batch from a single argsort.
+    AUC is the Mann-Whitney U with averaged ranks for ties, with the same values as roc_auc_score, whose ROC curve
+    starts at the highest threshold instead of the origin. MRR and NDCG break ties like mrr_score and dcg_score.
+    :param label: np.ndarray [N, C], padded with 0
+    :param pred: np.ndarray [N, C], padded positions are ignored
+    :param lengths: np.ndarray [N], number of candidates of each impression
+    :return: tuple of np.ndarray [N]: (auc, mrr, ndcg@5, ndcg@10)
+    """
+    lengths = np.asarray(lengths)
+    size = label.shape[1]
+    mask = length_mask(lengths, size)
+    score = np.where(mask, pred, -np.inf)
+    order = np.argsort(score, axis=1, kind="stable")  # ascending, padded positions go first
+    sorted_score = np.take_along_axis(score, order, axis=1)
+    sorted_label = np.take_along_axis(np.where(mask, label, 0), order, axis=1)
+    n_pos = sorted_label.sum(axis=1)
+    n_neg = lengths - n_pos
+    if np.any(n_pos == 0) or np.any(n_neg == 0):
+        raise ValueError('Only two class should be present in y_true. ROC AUC score '
+                         'is not defined in that case.')
+    # AUC: ranks are shifted by the number of padded positions in front
+    ranks = tie_average_ranks(sorted_score) - (size - lengths)[:, None]
+    auc = ((ranks * sorted_label).sum(axis=1) - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+    # remove the triangle between the origin and the first point of the curve (the top tied scores)
+    top = sorted_score == sorted_score[:, -1:]
+    top_pos = (sorted_label * top).sum(axis=1)
+    top_neg = top.sum(axis=1) - top_pos
+    auc = auc - top_pos * top_neg / (2 * n_pos * n_neg)
+    # MRR and NDCG: labels ranked by descending score
+    ranked = sorted_label[:, ::-1]
+    mrr = (ranked / (np.arange(size) + 1)).sum(axis=1) / n_pos
+    ideal = -np.sort(-sorted_label, axis=1)
+    ndcg_k = []
+    for k in (5, 10):
+        k = min(size, k)
+        discounts = np.log2(np.arange(k) + 2)
+        actual = ((2 ** ranked[:, :k] - 1) / discounts).sum(axis=1)
+        best = ((2 ** ideal[:, :k] - 1) / discounts).sum(axis=1)
+        ndcg_k.append(actual / best)
+    return auc, mrr, ndcg_k[0], ndcg_k[1]
@@ -4,11 +4,18 @@ import zipfile
 import math
 import logging
 import requests
+import threading
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from pathlib import Path
 from modules.utils import get_project_root, write_json, read_json
 
+try:
+    import orjson as json_parser  # optional, faster drop-in for json.loads
+except ImportError:
+    json_parser = json
+
 
 def load_entity(entity: str):
     """
@@ -16,7 +23,7 @@ def load_entity(entity: str):
     :param entity: entity string in json format
     :return: entities extracted from the input string
     """
-    return " ".join([" ".join(e["SurfaceForms"]) for e in json.loads(entity)])
+    return " ".join(sf for e in json_parser.loads(entity) for sf in e["SurfaceForms"])
 
 
 def load_category(**kwargs):
@@ -99,7 +106,67 @@ def rename_utils(util_path):
         func(path, util_path)
 
 
-def maybe_download(url, filename=None, work_directory=".", expected_bytes=None):
+def parallel_download(url, filepath, total_size, n_parts=8, block_size=1024 * 1024):
+    """Download a file with concurrent HTTP range requests, each part is written at its own offset.
+
+    The parts are written to a temporary ``filepath + ".part"`` file, which is renamed to filepath only when every
+    part is complete, so a failed download never leaves a full-size file behind.
+
+    Args:
+        url (str): URL of the file to download, the server must accept byte ranges.
+        filepath (str): Path of the downloaded file.
+        total_size (int): Size of the file in bytes.
+        n_parts (int): Number of parts downloaded concurrently.
+        block_size (int): Size of the chunks read from each response.
+
+    Returns:
+        bool: False if the server did not answer the range requests with partial content.
+    """
+    part_size = math.ceil(total_size / n_parts)
+    part_path = filepath + ".part"
+    stop = threading.Event()  # set when a part fails, so that the other parts stop early
+    refused = threading.Event()
+    bar = tqdm(total=total_size, unit="B", unit_scale=True)
+
+    def download_part(start):
+        end = min(start + part_size, total_size) - 1
+        written = 0
+        try:
+            with requests.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True) as r:
+                if r.status_code != 206:
+                    refused.set()
+                    stop.set()
+                    return
+                with open(part_path, "r+b") as part_file:
+                    part_file.seek(start)
+                    for data in r.iter_content(block_size):
+                        if stop.is_set():
+                            return
+                        part_file.write(data)
+                        written += len(data)
+                        bar.update(len(data))
+            if written != end - start + 1:
+                raise IOError(f"Incomplete download of bytes {start}-{end} from {url}: got {written} bytes")
+        except BaseException:
+            stop.set()
+            raise
+
+    try:
+        with open(part_path, "wb") as file:
+            file.truncate(total_size)  # preallocate the file so that parts can be written in any order
+        with ThreadPoolExecutor(max_workers=n_parts) as executor:
+            list(executor.map(download_part, range(0, total_size, part_size)))
+        if refused.is_set():
+            return False
+        os.replace(part_path, filepath)
+        return True
+    finally:
+        bar.close()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+
+def maybe_download(url, filename=None, work_directory=".", expected_bytes=None, n_parts=8):
     """Download a file if it is not already downloaded.
 
     Args:
@@ -107,6 +174,7 @@ def maybe_download(url, filename=None, work_directory=".", expected_bytes=None):
         work_directory (str): Working directory.
         url (str): URL of the file to download.
         expected_bytes (int): Expected file size in bytes.
+        n_parts (int): Number of concurrent range requests, used when the server accepts byte ranges.
 
     Returns:
         str: File path of the file downloaded.
@@ -119,17 +187,23 @@ def maybe_download(url, filename=None, work_directory=".", expected_bytes=None):
 
         r = requests.get(url, stream=True)
         total_size = int(r.headers.get("content-length", 0))
-        block_size = 1024
-        num_iterables = math.ceil(total_size / block_size)
-
-        with open(filepath, "wb") as file:
-            for data in tqdm(
-                    r.iter_content(block_size),
-                    total=num_iterables,
-                    unit="KB",
-                    unit_scale=True,
-            ):
-                file.write(data)
+        block_size = 1024 * 1024
+        downloaded = False
+        if n_parts > 1 and total_size > 0 and r.headers.get("accept-ranges") == "bytes":
+            r.close()
+            downloaded = parallel_download(url, filepath, total_size, n_parts, block_size)
+            if not downloaded:  # range requests were refused, download as a single stream instead
+                r = requests.get(url, stream=True)
+        if not downloaded:
+            num_iterables = math.ceil(total_size / block_size)
+            with open(filepath, "wb") as file:
+                for data in tqdm(
+                        r.iter_content(block_size),
+                        total=num_iterables,
+                        unit="MB",
+                        unit_scale=True,
+                ):
+                    file.write(data)
     else:
         logging.getLogger(__name__).info("File {} already downloaded".format(filepath))
     if expected_bytes is not None:
@@ -141,6 +215,44 @@ def maybe_download(url, filename=None, work_directory=".", expected_bytes=None):
     return filepath
 
 
+def extract_target(member, data_path):
+    """Path that ZipFile.extract writes a member to: drive, absolute, "." and ".." parts of its name are dropped.
+
+    Args:
+        member (zipfile.ZipInfo): Member of a zip file.
+        data_path: Directory to extract the files to.
+
+    Returns:
+        str: Path of the extracted member inside data_path.
+    """
+    arcname = member.filename.replace("/", os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid_path_parts = ("", os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep) if x not in invalid_path_parts)
+    return os.path.normpath(os.path.join(data_path, arcname))
+
+
+def parallel_extract(zip_path, data_path, max_workers=8):
+    """Extract all members of a zip file with a thread pool (decompression and file writes release the GIL).
+
+    Args:
+        zip_path (str): Path of the zip file.
+        data_path: Directory to extract the files to.
+        max_workers (int): Number of extracting threads.
+    """
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        members = zip_ref.infolist()
+        # create directories first, concurrent extract calls would race on creating the same parent directory
+        for member in members:
+            target = extract_target(member, data_path)
+            os.makedirs(target if member.is_dir() else os.path.dirname(target), exist_ok=True)
+        files = [member for member in members if not member.is_dir()]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda member: zip_ref.extract(member, data_path), files))
+
+
 def download_resources(download_url, data_path, remote_resource_name):
     """Download resources.
 
@@ -152,9 +264,7 @@ def download_resources(download_url, data_path, remote_resource_name):
     os.makedirs(data_path, exist_ok=True)
     remote_path = download_url + remote_resource_name
     maybe_download(remote_path, remote_resource_name, data_path)
-    zip_ref = zipfile.ZipFile(os.path.join(data_path, remote_resource_name), "r")
-    zip_ref.extractall(data_path)
-    zip_ref.close()
+    parallel_extract(os.path.join(data_path, remote_resource_name), data_path)
     os.remove(os.path.join(data_path, remote_resource_name))
 
 
@@ -1,8 +1,33 @@
 import os
+import torch
+import torch.distributed
 
+from functools import lru_cache
 from tqdm import tqdm
 from pathlib import Path
 from modules.utils import convert_dict_to_numpy, gather_dict, load_batch_data, gpu_stat, get_project_root
+from modules.utils.mind_untils import json_parser
+
+
+def capture_news_encoder(model, batch_dict, warmup_steps=3):
+    """
+    capture the news encoder forward of a fixed-shape batch into a CUDA graph (must run under torch.no_grad)
+    :param model: target running model
+    :param batch_dict: a batch of news data on the cuda device
+    :param warmup_steps: number of eager runs on a side stream before capturing
+    :return: the graph, its static input dictionary and static output tensor
+    """
+    static_input = {k: v.clone() for k, v in batch_dict.items()}
+    stream = torch.cuda.Stream()
+    stream.wait_stream(torch.cuda.current_stream())
+    with torch.cuda.stream(stream):
+        for _ in range(warmup_steps):
+            model.news_encoder(static_input)
+    torch.cuda.current_stream().wait_stream(stream)
+    graph = torch.cuda.CUDAGraph()
+    with torch.cuda.graph(graph):
+        static_output = model.news_encoder(static_input)["news_embed"]
+    return graph, static_input, static_output
 
 
 def get_news_embeds(model, news_loader, **kwargs):
@@ -10,12 +35,15 @@ def get_news_embeds(model, news_loader, **kwargs):
     run news model and return news vectors (numpy matrix)
     :param model: target running model
     :param news_loader: news loader with all news data
+    :param kwargs: use_cuda_graph replays a captured CUDA graph for every full-size batch
     :return: numpy matrix of news vectors (each row is a news vector)
     """
     news_embeds = {}
     assert news_loader is not None, "must specify news_loader"
     accelerator = kwargs.get("accelerator", None)
     device = kwargs.get("device")
+    use_cuda_graph = kwargs.get("use_cuda_graph", False) and torch.cuda.is_available()
+    graph, static_input, static_output = None, None, None
     if accelerator:
         news_loader = accelerator.prepare_data_loader(news_loader)
     bar = tqdm(news_loader, total=len(news_loader), disable=kwargs.get("disable_tqdm", True))
@@ -23,10 +51,18 @@ def get_news_embeds(model, news_loader, **kwargs):
         bar.set_description(f"Get news embeddings: {gpu_stat()}")
         # load data to device
         batch_dict = load_batch_data(batch_dict, device)
-        # run news encoder
-        news_vec = model.news_encoder(batch_dict)["news_embed"]
+        if use_cuda_graph and graph is None:
+            graph, static_input, static_output = capture_news_encoder(model, batch_dict)
+        # run news encoder: replay the graph when shapes match, fall back to eager otherwise (e.g. last batch)
+        if graph is not None and all(static_input[k].shape == v.shape for k, v in batch_dict.items()):
+            for k, v in batch_dict.items():
+                static_input[k].copy_(v, non_blocking=True)
+            graph.replay()
+            news_vec = static_output
+        else:
+            news_vec = model.news_encoder(batch_dict)["news_embed"]
         # update news vectors
-        news_embeds.update(dict(zip(batch_dict["index"].cpu().tolist(), news_vec.cpu().numpy())))
+        news_embeds.update(dict(zip(batch_dict["index"].cpu().tolist(), news_vec.float().cpu().numpy())))
     del batch_dict
     return convert_dict_to_numpy(gather_dict(news_embeds, kwargs.get("num_processes", None)))
 
@@ -44,6 +80,25 @@ def get_default_upath(**kwargs):
     return uid_path
 
 
+@lru_cache(maxsize=4)
+def load_uid2index(uid_path):
+    """
+    load user id dictionary once per process (the returned dictionary is shared, do not modify it);
+    in distributed runs only rank 0 parses the file and broadcasts it to the other ranks
+    :param uid_path: path of the user id dictionary
+    :return: user id dictionary
+    """
+    if torch.distributed.is_initialized():
+        uid2index = [None]
+        if torch.distributed.get_rank() == 0:
+            with open(uid_path, "rb") as handle:
+                uid2index[0] = json_parser.loads(handle.read())
+        torch.distributed.broadcast_object_list(uid2index, src=0)
+        return uid2index[0]
+    with open(uid_path, "rb") as handle:
+        return json_parser.loads(handle.read())
+
+
 def get_news_info(**kwargs):
     """
     get news information items